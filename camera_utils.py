@@ -0,0 +1,131 @@
+import cv2
+import threading
+import time
+
+
+def request_mjpeg(cap, width=1280, height=720, fps=30):
+    """
+    Asks the camera for MJPEG instead of its default (usually raw YUYV).
+    Compressed frames need much less USB bandwidth, so the camera can run
+    at higher resolutions/frame rates, and JPEG decoding is SIMD-accelerated.
+    Returns True if the camera accepted MJPEG. If it didn't, the original
+    size and frame rate are restored, since most USB2 cameras can't carry
+    raw YUYV at the requested size without dropping frames.
+    """
+    original_width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    original_height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    original_fps = cap.get(cv2.CAP_PROP_FPS)
+
+    # The FOURCC has to be set before the size for V4L2 to honour it
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cap.set(cv2.CAP_PROP_FPS, fps)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    # Some backends (e.g. DirectShow) report the FOURCC as a negative number
+    fourcc = int(cap.get(cv2.CAP_PROP_FOURCC)) & 0xFFFFFFFF
+    codec = fourcc.to_bytes(4, 'little').decode('ascii', errors='replace')
+    if codec != 'MJPG':
+        print(f"Camera does not support MJPEG, streaming as {codec!r} at its default size instead.")
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, original_width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, original_height)
+        if original_fps > 0:
+            cap.set(cv2.CAP_PROP_FPS, original_fps)
+        return False
+    return True
+
+
+class FrameGrabber:
+    """
+    Reads frames from a cv2.VideoCapture on a background thread.
+    The newest frame is kept in a single-slot buffer so the main thread
+    only has to display it, instead of also blocking on the camera driver.
+
+    If target_fps is set, frames are still grabbed at the camera's rate (so
+    the stream never lags behind) but only decoded at target_fps.
+    """
+
+    def __init__(self, src, target_fps=None):
+        self.cap = cv2.VideoCapture(src)
+        self.target_fps = target_fps
+        self.grabbed, self.frame = False, None
+        self.frame_id = 0
+        self.last_read_id = 0
+        self.started = False
+        self.read_lock = threading.Lock()
+        self.new_frame = threading.Condition(self.read_lock)
+        self.thread = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        if self.started:
+            return self
+        # Read the first frame synchronously so read() has something to return
+        self.grabbed, self.frame = self.cap.read()
+        self.frame_id = 1
+        self.started = True
+        self.thread = threading.Thread(target=self._update, daemon=True)
+        self.thread.start()
+        return self
+
+    def _update(self):
+        next_show = time.perf_counter()
+        while self.started:
+            if self.target_fps is None:
+                grabbed, frame = self.cap.read()
+            else:
+                # grab() advances the stream without decoding; only
+                # retrieve() (decode) the frames that will be shown
+                grabbed, frame = self.cap.grab(), None
+                if grabbed:
+                    now = time.perf_counter()
+                    if now < next_show:
+                        continue
+                    next_show = max(next_show + 1.0 / self.target_fps, now)
+                    grabbed, frame = self.cap.retrieve()
+            with self.new_frame:
+                self.grabbed, self.frame = grabbed, frame
+                self.frame_id += 1
+                self.new_frame.notify_all()
+            if not grabbed:
+                break
+
+    def read(self, timeout=1.0):
+        """
+        Waits (up to timeout seconds) for a frame newer than the last one
+        returned, so the display loop runs at the camera's rate instead of
+        spinning. Returns (grabbed, frame) like cv2.VideoCapture.read().
+        """
+        with self.new_frame:
+            self.new_frame.wait_for(
+                lambda: self.frame_id != self.last_read_id or not self.started,
+                timeout,
+            )
+            self.last_read_id = self.frame_id
+            # Return a reference rather than a copy; the reader thread replaces
+            # self.frame with a new array instead of writing into the old one.
+            return self.grabbed, self.frame
+
+    def stop(self):
+        self.started = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def release(self):
+        self.stop()
+        self.cap.release()
+
+
+def get_poll_key():
+    """
+    Returns a function that handles pending GUI events and returns the key
+    pressed, if any, like waitKey(1). Uses cv2.pollKey() where available: on
+    Win32 it skips waitKey(1)'s sleep, while on other GUI backends it just
+    runs waitKey(1) internally. Older OpenCV builds use waitKey(1) directly.
+    Both return just the key code (since OpenCV 3.2), so no "& 0xFF" mask
+    is needed.
+    """
+    return getattr(cv2, 'pollKey', lambda: cv2.waitKey(1))
@@ -1,6 +1,302 @@
 import pyrealsense2 as rs
 import numpy as np
 import cv2
+import ctypes
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+from camera_utils import FrameGrabber, get_poll_key, request_mjpeg
+
+
+# Resolution and frame rate of both RealSense streams
+WIDTH, HEIGHT, FPS = 640, 480, 30
+
+# Without an X/Wayland display (e.g. over SSH) there is nothing to show
+# frames on, so the colormap and display work is skipped entirely.
+HEADLESS = sys.platform.startswith('linux') and not (
+    os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')
+)
+
+# Aligning depth to the color camera is the most expensive per-frame step
+# (several ms on a laptop, hundreds of ms on ARM boards). A side-by-side
+# preview doesn't need it, so it is off by default; without it the two
+# images are slightly offset from each other.
+ALIGN = False
+
+# Depth is decimated by this factor (in-SDK, SIMD) before anything else
+# touches it, so alignment has 4x fewer pixels to process at 2. The preview
+# is scaled back up for display. Set to 1 to keep full resolution.
+DECIMATION = 2
+
+# Give up if the camera delivers no frames for this many seconds (e.g. it
+# was unplugged), like wait_for_frames() does with its default timeout
+FRAME_TIMEOUT = 5.0
+
+# Decode and show at most this many webcam frames per second; the rest are
+# grabbed (to keep the stream current) but skipped without decoding.
+# None shows every frame.
+TARGET_FPS = None
+
+# Scale used to map 16-bit depth (in depth units) into the 0-255 colormap range
+DEPTH_ALPHA = 0.03
+
+
+def create_align():
+    """
+    Returns a processing block that aligns depth to the color stream, or
+    None if ALIGN is off. Uses the GLSL (GPU) implementation when
+    pyrealsense2 was built with it, else the regular CPU one.
+    """
+    if not ALIGN:
+        return None
+    try:
+        import pyrealsense2.gl as rsgl
+        return rsgl.align(rs.stream.color)
+    except (ImportError, AttributeError, RuntimeError):
+        return rs.align(rs.stream.color)
+
+
+def load_depth_vis(alpha=DEPTH_ALPHA):
+    """
+    Loads the optional native depth_vis kernel (see depth_vis.c), which fuses
+    depth scaling and the JET lookup using SIMD where available.
+    Returns a function depth_vis(depth_image, out), or None if the library
+    hasn't been built or has no usable SIMD path, in which case
+    convertScaleAbs + applyColorMap are used.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ('depth_vis.so', 'depth_vis.dylib', 'depth_vis.dll'):
+        path = os.path.join(here, name)
+        if os.path.exists(path):
+            break
+    else:
+        return None
+
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError as e:
+        print(f"Could not load {path}, using the OpenCV colormap instead: {e}")
+        return None
+
+    # Without NEON/AVX2 the kernel is slower than OpenCV's two calls
+    simd = getattr(lib, 'depth_vis_simd', None)
+    if simd is None or not simd():
+        print(f"{path} has no usable SIMD path, using the OpenCV colormap instead.")
+        return None
+
+    lib.depth_vis.argtypes = [
+        ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_size_t,
+        ctypes.c_void_p, ctypes.c_float, ctypes.c_void_p, ctypes.c_size_t,
+    ]
+    lib.depth_vis.restype = None
+
+    # The kernel does the scaling itself, so it only needs the 256-entry map
+    jet = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), cv2.COLORMAP_JET)
+    jet = np.ascontiguousarray(jet.reshape(256, 3))
+
+    def depth_vis(depth_image, out):
+        rows, cols = depth_image.shape
+        if out.shape != (rows, cols, 3) or out.strides[1:] != (3, 1) or depth_image.strides[1] != 2:
+            raise ValueError("depth_vis needs a uint16 depth image and a matching BGR output")
+        lib.depth_vis(
+            depth_image.ctypes.data, rows, cols, depth_image.strides[0],
+            jet.ctypes.data, alpha, out.ctypes.data, out.strides[0],
+        )
+
+    return depth_vis
+
+
+# Number of shared-memory frame slots: one being filled by the reader, one
+# being rendered by the worker process and one being displayed.
+FRAME_SLOTS = 3
+
+
+def frame_slot_layout():
+    """
+    Returns the (dtype, shape) of each array in a frame slot: the depth
+    input (flat, big enough for full resolution), the YUYV color input and
+    the side-by-side BGR display output.
+    """
+    return [
+        (np.uint16, (HEIGHT * WIDTH,)),
+        (np.uint8, (HEIGHT, WIDTH, 2)),
+        (np.uint8, (HEIGHT, 2 * WIDTH, 3)),
+    ]
+
+
+def frame_slots_size():
+    """Returns the number of bytes needed for FRAME_SLOTS frame slots."""
+    slot_size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for dtype, shape in frame_slot_layout())
+    return slot_size * FRAME_SLOTS
+
+
+def map_frame_slots(shm):
+    """
+    Views a SharedMemory block as FRAME_SLOTS (depth_in, color_in, display)
+    array triples. Every array size is a multiple of 64 bytes and the block
+    itself is page aligned, so all arrays start 64-byte aligned for SIMD.
+    (Huge pages aren't requested: Linux doesn't use them for /dev/shm
+    mappings unless shmem_enabled is turned on, and it's off by default.)
+    """
+    slots = []
+    offset = 0
+    for _ in range(FRAME_SLOTS):
+        slot = []
+        for dtype, shape in frame_slot_layout():
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            offset += array.nbytes
+            slot.append(array)
+        slots.append(tuple(slot))
+    return slots
+
+
+def frame_to_array(frame, dtype, channels=1):
+    """
+    Wraps a RealSense video frame's buffer as a numpy array without copying.
+    The array keeps the frame's data alive, so it stays valid after the
+    frame object itself goes out of scope. Treat it as read-only.
+    """
+    shape = (frame.get_height(), frame.get_width())
+    if channels > 1:
+        shape += (channels,)
+    return np.frombuffer(frame.get_data(), dtype=dtype).reshape(shape)
+
+
+def get_until_stopped(q, stop_event):
+    """
+    Gets an item from a queue, blocking while it is empty.
+    Returns None once stop_event is set.
+    """
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+def read_frames(frame_queue, decimate, align, slots, free_q, task_q, stop_event):
+    """
+    Reader stage: takes framesets from the SDK's frame queue, decimates
+    and aligns them (for each block that isn't None), copies them into a
+    free shared-memory slot and hands the slot to the render process.
+    With slots=None (headless) frames are read and then dropped.
+    Returns (ending the thread) if no frame arrives within FRAME_TIMEOUT.
+    """
+    last_frame_time = time.perf_counter()
+    while not stop_event.is_set():
+        # Wait for a coherent pair of frames: depth and color.
+        # The timeout lets the thread notice stop_event.
+        got_frame, frame = frame_queue.try_wait_for_frame(100)
+        if not got_frame:
+            if time.perf_counter() - last_frame_time > FRAME_TIMEOUT:
+                print(f"Error: No frames received from the RealSense camera for {FRAME_TIMEOUT:.0f} seconds.")
+                return
+            continue
+        last_frame_time = time.perf_counter()
+        frames = frame.as_frameset()
+
+        # Shrink the depth frame first so alignment has less work to do
+        if decimate is not None:
+            frames = decimate.process(frames).as_frameset()
+
+        # Align the depth frame to the color frame
+        if align is not None:
+            frames = align.process(frames)
+
+        # Get the (possibly aligned) frames
+        depth_frame = frames.get_depth_frame()
+        color_frame = frames.get_color_frame()
+
+        # Validate that both frames are valid
+        if not depth_frame or not color_frame:
+            continue
+
+        if slots is None:
+            continue
+
+        # Wait for a free slot; this is what applies back-pressure
+        slot = get_until_stopped(free_q, stop_event)
+        if slot is None:
+            break
+        depth_in, color_in, _ = slots[slot]
+
+        # View the frame data as numpy arrays (no copy) and copy them once,
+        # into shared memory the render process can see
+        depth_image = frame_to_array(depth_frame, np.uint16)
+        depth_in[:depth_image.size] = depth_image.ravel()
+        color_in[...] = frame_to_array(color_frame, np.uint8, channels=2)
+
+        task_q.put((slot, depth_image.shape))
+
+
+def render_frames(shm_name, task_q, done_q):
+    """
+    Processor stage, run in its own process so the colormap work doesn't
+    compete with the reader and GUI for the GIL. For each (slot, depth_shape)
+    task it converts the color and colormaps the depth side by side into the
+    slot's display buffer, then reports the slot on done_q. Stops on None.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        slots = map_frame_slots(shm)
+
+        # Prefer the native kernel if it has been built, else use OpenCV
+        depth_vis = load_depth_vis()
+
+        # Holds the colormap of decimated depth before it is scaled up
+        small_colormap = None
+
+        while True:
+            task = task_q.get()
+            if task is None:
+                break
+            slot, depth_shape = task
+            depth_in, color_yuyv, display = slots[slot]
+            depth_image = depth_in[:depth_shape[0] * depth_shape[1]].reshape(depth_shape)
+
+            # Color goes in the left half, converted from YUYV in place
+            cv2.cvtColor(color_yuyv, cv2.COLOR_YUV2BGR_YUYV, dst=display[:, :WIDTH])
+
+            # Apply a colormap to the depth image for visualization
+            # This converts the 16-bit (z16) depth image to an 8-bit (uint8)
+            # BGR image that OpenCV can display, written straight into the
+            # right half.
+            depth_colormap = display[:, WIDTH:]
+            if depth_image.shape != (HEIGHT, WIDTH):
+                # Decimated (and not aligned) depth is colormapped at its own
+                # size first, then scaled up below
+                if small_colormap is None or small_colormap.shape[:2] != depth_image.shape:
+                    small_colormap = np.empty(depth_image.shape + (3,), dtype=np.uint8)
+                depth_colormap = small_colormap
+
+            if depth_vis is not None:
+                depth_vis(depth_image, depth_colormap)
+            else:
+                cv2.applyColorMap(
+                    cv2.convertScaleAbs(depth_image, alpha=DEPTH_ALPHA),
+                    cv2.COLORMAP_JET,
+                    dst=depth_colormap,
+                )
+
+            if depth_colormap is small_colormap:
+                cv2.resize(
+                    small_colormap, (WIDTH, HEIGHT), dst=display[:, WIDTH:],
+                    interpolation=cv2.INTER_NEAREST,
+                )
+
+            done_q.put(slot)
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group; the parent cleans up
+        pass
+    finally:
+        shm.close()
+
 
 def run_realsense():
     """
@@ -14,89 +310,177 @@ def run_realsense():
     config = rs.config()
 
     # Tell config that we want to stream both depth and color data
-    config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-    config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
+    config.enable_stream(rs.stream.depth, WIDTH, HEIGHT, rs.format.z16, FPS)
+    # Color is requested as the camera's native YUYV so the SDK doesn't have
+    # to convert it (and USB carries 2 bytes per pixel instead of 3); it is
+    # converted to BGR once, straight into the display buffer.
+    config.enable_stream(rs.stream.color, WIDTH, HEIGHT, rs.format.yuyv, FPS)
 
-    # Create an align object
-    # rs.align aligns the depth frame to the perspective of the color frame
-    align_to = rs.stream.color
-    align = rs.align(align_to)
+    # Create a decimation filter (None when DECIMATION is 1)
+    decimate = rs.decimation_filter(DECIMATION) if DECIMATION > 1 else None
+
+    # Create an align object (None when ALIGN is off)
+    # It aligns the depth frame to the perspective of the color frame
+    align = create_align()
     
+    # The SDK pushes framesets into this queue from its own thread. With a
+    # capacity of 1 and keep_frames=False only the newest frameset is kept,
+    # so a slow consumer sees fresh frames instead of a growing backlog.
+    frame_queue = rs.frame_queue(1, keep_frames=False)
+
     # Start streaming
     print("Starting RealSense pipeline...")
     try:
-        profile = pipeline.start(config)
+        profile = pipeline.start(config, frame_queue)
     except Exception as e:
         print(f"Failed to start RealSense pipeline: {e}")
         print("Is the RealSense camera plugged in?")
         return
 
+    # Reader thread (frame queue + decimate + align) -> render process
+    # (colormap + stack) -> display. Frames move between them through slots
+    # of shared memory, so only slot numbers cross the process boundary.
+    # A slot is reused only after it has been displayed, which bounds how
+    # many frames can be in flight.
+    stop_event = threading.Event()
+    shm = None
+    slots = None
+    renderer = None
+    reader = None
+    free_q = queue.Queue()
+    task_q = done_q = None
+
+    # Everything after pipeline.start() runs inside this try so the finally
+    # below releases the camera (and whatever else was set up) on any error.
     try:
+        if not HEADLESS:
+            shm = shared_memory.SharedMemory(create=True, size=frame_slots_size())
+            slots = map_frame_slots(shm)
+            for slot in range(FRAME_SLOTS):
+                free_q.put(slot)
+
+            # spawn (rather than fork) so the child doesn't inherit the SDK's threads
+            ctx = multiprocessing.get_context('spawn')
+            task_q, done_q = ctx.Queue(), ctx.Queue()
+            renderer = ctx.Process(target=render_frames, args=(shm.name, task_q, done_q), daemon=True)
+            renderer.start()
+
+        reader = threading.Thread(
+            target=read_frames,
+            args=(frame_queue, decimate, align, slots, free_q, task_q, stop_event),
+            daemon=True,
+        )
+        reader.start()
+
+        if HEADLESS:
+            print("No display found, running headless (no visualization). Press Ctrl+C to stop.")
+        else:
+            # Create the display window once, up front
+            cv2.namedWindow('RealSense Color and Depth', cv2.WINDOW_AUTOSIZE)
+
+        # Look these up once rather than on every frame (see get_poll_key)
+        poll_key = get_poll_key()
+        key_q, key_esc = ord('q'), 27
+
+        # The GUI stays on the main thread (required by cv2.imshow on macOS)
         while True:
-            # --- Get Frames ---
-            # Wait for a coherent pair of frames: depth and color
-            frames = pipeline.wait_for_frames()
-            
-            # Align the depth frame to the color frame
-            aligned_frames = align.process(frames)
+            # The reader ends on a frame timeout or an SDK error
+            if not reader.is_alive():
+                print("Error: Stopped receiving frames from the RealSense camera.")
+                break
 
-            # Get the aligned frames
-            depth_frame = aligned_frames.get_depth_frame() 
-            color_frame = aligned_frames.get_color_frame()
-            
-            # Validate that both frames are valid
-            if not depth_frame or not color_frame:
+            if HEADLESS:
+                # Frames are still read (and aligned), just not visualized
+                stop_event.wait(0.5)
                 continue
-                
-            # --- Process Frames ---
-            # Convert images to numpy arrays
-            depth_image = np.asanyarray(depth_frame.get_data())
-            color_image = np.asanyarray(color_frame.get_data())
-            
-            # Apply a colormap to the depth image for visualization
-            # This converts the 16-bit (z16) depth image to an 8-bit (uint8)
-            # BGR image that OpenCV can display.
-            depth_colormap = cv2.applyColorMap(
-                cv2.convertScaleAbs(depth_image, alpha=0.03), 
-                cv2.COLORMAP_JET
-            )
 
             # --- Display Images ---
-            # Stack images horizontally (side-by-side)
-            images = np.hstack((color_image, depth_colormap))
+            try:
+                slot = done_q.get(timeout=0.1)
+            except queue.Empty:
+                if not renderer.is_alive():
+                    print("Error: The render process exited unexpectedly.")
+                    break
+                # Nothing new yet; keep the GUI responsive while we wait
+                key = poll_key()
+                if key == key_q or key == key_esc:
+                    break
+                continue
             
-            # Show the combined image in a window
-            cv2.namedWindow('RealSense Color and Depth', cv2.WINDOW_AUTOSIZE)
-            cv2.imshow('RealSense Color and Depth', images)
+            # Show the combined image in a window. imshow copies the image,
+            # so the slot can be refilled straight away.
+            cv2.imshow('RealSense Color and Depth', slots[slot][2])
+            free_q.put(slot)
             
             # Exit the loop when 'q' or 'ESC' is pressed
-            key = cv2.waitKey(1)
-            if key & 0xFF == ord('q') or key == 27:
+            key = poll_key()
+            if key == key_q or key == key_esc:
                 break
 
+    except KeyboardInterrupt:
+        # Ctrl+C is the only way to stop when running headless
+        pass
     finally:
         # --- Cleanup ---
+        # Always release the camera, even if the loop raised; otherwise the
+        # device stays claimed and the next run stalls opening it.
+        # Cleanup errors are swallowed so they don't mask the original one.
         print("Stopping RealSense pipeline...")
-    pipeline.stop()
-    cv2.destroyAllWindows()
+        # Setup may have failed part way, so anything here can still be None
+        stop_event.set()
+        if reader is not None and reader.is_alive():
+            reader.join()
+        if renderer is not None and renderer.is_alive():
+            task_q.put(None)
+            renderer.join(timeout=5)
+            if renderer.is_alive():
+                renderer.terminate()
+        if shm is not None:
+            # Drop our views before closing the mapping
+            slots = None
+            try:
+                shm.close()
+                shm.unlink()
+            except Exception:
+                pass
+        try:
+            pipeline.stop()
+        except Exception:
+            pass
+        try:
+            cv2.destroyAllWindows()
+        except Exception:
+            pass
 
-def run_webcam():
+def run_webcam(target_fps=None):
     """
     Initializes and streams from a normal webcam (RGB only).
     Tries multiple camera indices to find a working one.
     If multiple cameras are found, it asks the user to select one.
+    If target_fps is given, frames beyond that rate are skipped without
+    being decoded.
     """
 
     # --- Start Stream ---
-    cap = cv2.VideoCapture(0)
+    cap = FrameGrabber(0, target_fps)
     
     if not cap.isOpened():
         print(f"Error: Failed to open camera at index (it may be in use).")
         return
 
+    # Prefer compressed MJPEG so the camera isn't limited by raw YUYV bandwidth
+    request_mjpeg(cap.cap)
+
+    # Frames are captured on a background thread; this loop only displays them
+    cap.start()
+
+    # Look these up once rather than on every frame (see get_poll_key)
+    poll_key = get_poll_key()
+    key_q, key_esc = ord('q'), 27
+
     try:
         while True:
-            # Capture frame-by-frame
+            # Wait for the next frame from the reader thread
             ret, frame = cap.read()
             
             # if frame is read correctly ret is True
@@ -108,8 +492,8 @@ def run_webcam():
             cv2.imshow('Normal Webcam', frame)
             
             # Exit the loop when 'q' or 'ESC' is pressed
-            key = cv2.waitKey(1)
-            if key & 0xFF == ord('q') or key == 27:
+            key = poll_key()
+            if key == key_q or key == key_esc:
                 break
                 
     finally:
@@ -130,7 +514,7 @@ def main():
     if choice == '1':
         run_realsense()
     elif choice == '2':
-        run_webcam()
+        run_webcam(TARGET_FPS)
     else:
         print("Invalid choice. Please run the script again and enter 1 or 2.")
 
@@ -1,36 +1,63 @@
 import cv2
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-def run_webcam():
+from camera_utils import FrameGrabber, get_poll_key, request_mjpeg
+
+# Decode and show at most this many webcam frames per second; the rest are
+# grabbed (to keep the stream current) but skipped without decoding.
+# None shows every frame.
+TARGET_FPS = None
+
+
+def probe_camera(index):
+    """
+    Checks whether a camera can be opened at the given index.
+    Returns the backend that worked (cv2.CAP_ANY or cv2.CAP_V4L2), or None.
+    """
+    # We explicitly use the V4L2 backend on Linux, but CAP_ANY is more cross-platform.
+    # Let's try CAP_ANY first.
+    cap_test = cv2.VideoCapture(index, cv2.CAP_ANY)
+    if cap_test.isOpened():
+        # Release it, we're just checking
+        cap_test.release()
+        return cv2.CAP_ANY
+
+    # Only retry with the V4L2 backend if CAP_ANY failed, as per your error
+    # logs; when CAP_ANY succeeds there is nothing left to check.
+    cap_test = cv2.VideoCapture(index, cv2.CAP_V4L2)
+    if cap_test.isOpened():
+        cap_test.release()
+        return cv2.CAP_V4L2
+    return None
+
+
+def run_webcam(target_fps=None):
     """
     Initializes and streams from a normal webcam (RGB only).
     Tries multiple camera indices to find a working one.
     If multiple cameras are found, it asks the user to select one.
+    If target_fps is given, frames beyond that rate are skipped without
+    being decoded.
     """
     cap = None
     found_cam_index = -1
     available_indices = []
 
-    # Try camera indices from 0 to 4 to find all working ones
+    # Try camera indices from 0 to 4 to find all working ones.
+    # Opening a missing device can block for hundreds of milliseconds, so
+    # all indices are probed at the same time rather than one after another.
     print("Searching for a working webcam...")
-    for i in range(5):
-        # We explicitly use the V4L2 backend on Linux, but CAP_ANY is more cross-platform.
-        # Let's try CAP_ANY first.
-        cap_test_any = cv2.VideoCapture(i, cv2.CAP_ANY)
-        
-        if cap_test_any.isOpened():
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(probe_camera, range(5)))
+
+    for i, backend in enumerate(results):
+        if backend == cv2.CAP_ANY:
             print(f"Success: Found a working camera at index {i}.")
             available_indices.append(i)
-            # Release it, we're just checking
-            cap_test_any.release()
-        else:
-            # Try V4L2 backend specifically if CAP_ANY failed, as per your error logs
-            cap_test_v4l = cv2.VideoCapture(i, cv2.CAP_V4L2)
-            if cap_test_v4l.isOpened():
-                print(f"Success: Found a working camera at index {i} (using V4L2).")
-                available_indices.append(i)
-                cap_test_v4l.release()
-
+        elif backend == cv2.CAP_V4L2:
+            print(f"Success: Found a working camera at index {i} (using V4L2).")
+            available_indices.append(i)
 
     # --- Selection Logic ---
     if len(available_indices) == 0:
@@ -64,15 +91,25 @@ def run_webcam():
     # --- Start Stream ---
     print(f"Starting webcam stream from index {found_cam_index}...")
     # Use CAP_ANY to be safe, but you could also use found_cam_index directly
-    cap = cv2.VideoCapture(found_cam_index) 
+    cap = FrameGrabber(found_cam_index, target_fps)
     
     if not cap.isOpened():
         print(f"Error: Failed to open camera at index {found_cam_index} (it may be in use).")
         return
 
+    # Prefer compressed MJPEG so the camera isn't limited by raw YUYV bandwidth
+    request_mjpeg(cap.cap)
+
+    # Frames are captured on a background thread; this loop only displays them
+    cap.start()
+
+    # Look these up once rather than on every frame (see get_poll_key)
+    poll_key = get_poll_key()
+    key_q, key_esc = ord('q'), 27
+
     try:
         while True:
-            # Capture frame-by-frame
+            # Wait for the next frame from the reader thread
             ret, frame = cap.read()
             
             # if frame is read correctly ret is True
@@ -84,8 +121,8 @@ def run_webcam():
             cv2.imshow('Normal Webcam', frame)
             
             # Exit the loop when 'q' or 'ESC' is pressed
-            key = cv2.waitKey(1)
-            if key & 0xFF == ord('q') or key == 27:
+            key = poll_key()
+            if key == key_q or key == key_esc:
                 break
                 
     finally:
@@ -95,4 +132,4 @@ def run_webcam():
         cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    run_webcam()
\ No newline at end of file
+    run_webcam(TARGET_FPS)
\ No newline at end of file